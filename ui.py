@@ -14,16 +14,20 @@ Prereqs:
   FLOWISE_API_KEY=YOUR_REAL_API_KEY   (if your flow requires auth)
 Run:
   source .venv/bin/activate
-  pip install streamlit python-dotenv requests
+  pip install streamlit python-dotenv "httpx[http2]" orjson msgspec
   streamlit run app1_ui_updated.py
 """
 
 import os
-import json
-import re
-import uuid
-import requests
+import secrets
+import orjson
+import msgspec
+import asyncio
+import threading
+import time
+import httpx
 from datetime import datetime
+from typing import Any
 
 import streamlit as st
 from dotenv import load_dotenv
@@ -41,8 +45,14 @@ st.set_page_config(
 # -------------------------------
 # STYLES
 # -------------------------------
-st.markdown(
-    """
+def _html(block: str):
+    # st.html (Streamlit >= 1.33) skips the markdown parser for pre-rendered HTML
+    if hasattr(st, "html"):
+        st.html(block)
+    else:
+        st.markdown(block, unsafe_allow_html=True)
+
+_CSS_BLOCK = """
 <style>
 :root{
   --primary:#0B5ED7;
@@ -91,32 +101,59 @@ html, body, [class*="css"]{
 hr{border:0;border-top:1px solid var(--border); margin: 10px 0;}
 .section-title{font-size: 16px; font-weight: 800; margin: 0 0 6px;}
 </style>
-""",
-    unsafe_allow_html=True,
-)
+"""
+_html(_CSS_BLOCK)
 
 # -------------------------------
 # HEADER
 # -------------------------------
-st.markdown(
-    """
+_HERO_BLOCK = """
 <div class="hero">
   <div class="badge">Decision-support • Flowise-orchestrated • Singapore-specific</div>
   <div class="h1">🏙️ HDB Assist AI</div>
   <div class="sub">Streamlit UI → Flowise AgentFlow (logic/RAG) → Streamlit renders structured report.</div>
 </div>
-""",
-    unsafe_allow_html=True,
-)
+"""
+_html(_HERO_BLOCK)
 
 # -------------------------------
 # ENV + FLOWISE CONFIG
 # -------------------------------
-load_dotenv()
+@st.cache_resource
+def _env():
+    load_dotenv()
+    return {
+        "base": os.getenv("FLOWISE_BASE_URL", "https://cloud.flowiseai.com").rstrip("/"),
+        "cid": os.getenv("FLOWISE_CHATFLOW_ID", "28bddf08-01dc-4472-aa7f-e6f7e2c0297f"),
+        "key": os.getenv("FLOWISE_API_KEY", ""),
+    }
+
+_cfg = _env()
+FLOWISE_BASE_URL = _cfg["base"]
+FLOWISE_CHATFLOW_ID = _cfg["cid"]
+FLOWISE_API_KEY = _cfg["key"]
+
+_FLOWISE_URL = f"{FLOWISE_BASE_URL}/api/v1/prediction/{FLOWISE_CHATFLOW_ID}"
+_FLOWISE_HEADERS = {"Content-Type": "application/json"}
+if FLOWISE_API_KEY:
+    _FLOWISE_HEADERS["Authorization"] = f"Bearer {FLOWISE_API_KEY}"
+
+
+@st.cache_resource
+def _aio():
+    # one long-lived loop thread owns the AsyncClient, so its HTTP/2 pool survives script reruns
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    client = httpx.AsyncClient(
+        http2=True,
+        timeout=180,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    )
+    return loop, client
 
-FLOWISE_BASE_URL = os.getenv("FLOWISE_BASE_URL", "https://cloud.flowiseai.com").rstrip("/")
-FLOWISE_CHATFLOW_ID = os.getenv("FLOWISE_CHATFLOW_ID", "28bddf08-01dc-4472-aa7f-e6f7e2c0297f")
-FLOWISE_API_KEY = os.getenv("FLOWISE_API_KEY", "")
+def _run(coro_fn, *args):
+    loop, client = _aio()
+    return asyncio.run_coroutine_threadsafe(coro_fn(client, *args), loop).result()
 
 # -------------------------------
 # SESSION STATE
@@ -124,126 +161,244 @@ FLOWISE_API_KEY = os.getenv("FLOWISE_API_KEY", "")
 if "chat_messages" not in st.session_state:
     st.session_state.chat_messages = []
 if "sid" not in st.session_state:
-    st.session_state.sid = str(uuid.uuid4())
+    st.session_state.sid = secrets.token_hex(16)
 
 # -------------------------------
 # SIDEBAR
 # -------------------------------
+_cf = f"{FLOWISE_CHATFLOW_ID[:8]}…{FLOWISE_CHATFLOW_ID[-6:]}" if FLOWISE_CHATFLOW_ID else "(not set)"
+_auth = "✅ API key set" if FLOWISE_API_KEY else "⚠️ No API key in .env"
+_SIDEBAR_INFO = f"""
+---
+### 🔗 Flowise Cloud
+<small>Base URL: {FLOWISE_BASE_URL}<br>Chatflow ID: {_cf}<br>Auth: {_auth}</small>
+
+---
+### 🚨 Emergency
+<small>If there is immediate danger, call **995 (SCDF)** or **999 (Police)**.</small>
+
+---
+### 🛡 Responsible AI
+<small>This is a decision-support prototype. It does **not** file reports to agencies. Verify urgent cases with official channels.</small>
+"""
+
 with st.sidebar:
     st.header("⚙️ Controls")
     show_debug = st.checkbox("Show debug payload", value=False)
-
-    st.markdown("---")
-    st.subheader("🔗 Flowise Cloud")
-    st.caption(f"Base URL: {FLOWISE_BASE_URL}")
-    st.caption(f"Chatflow ID: {FLOWISE_CHATFLOW_ID[:8]}…{FLOWISE_CHATFLOW_ID[-6:]}" if FLOWISE_CHATFLOW_ID else "Chatflow ID: (not set)")
-    st.caption("Auth: ✅ API key set" if FLOWISE_API_KEY else "Auth: ⚠️ No API key in .env")
-
-    st.markdown("---")
-    st.subheader("🚨 Emergency")
-    st.caption("If there is immediate danger, call **995 (SCDF)** or **999 (Police)**.")
-
-    st.markdown("---")
-    st.subheader("🛡 Responsible AI")
-    st.caption("This is a decision-support prototype. It does **not** file reports to agencies. Verify urgent cases with official channels.")
+    st.markdown(_SIDEBAR_INFO, unsafe_allow_html=True)
 
 # -------------------------------
 # FLOWISE HELPERS
 # -------------------------------
+# Only the fields read by extract_json_from_flowise_response; msgspec skips the rest of the payload.
+class _NodeData(msgspec.Struct):
+    output: Any = None
+
+class _Node(msgspec.Struct):
+    data: _NodeData | None = None
+
+class _FlowiseResp(msgspec.Struct):
+    text: str | None = None
+    agentFlowExecutedData: list[_Node] | None = None
+
+_DECODE_RESP = msgspec.json.Decoder(_FlowiseResp)
+
 def _extract_json_anywhere(text: str):
-    t = (text or "").strip()
-    if not t:
+    if not text:
+        return None
+    i = text.find("{")
+    if i == -1:
         return None
     try:
-        return json.loads(t)
-    except Exception:
-        m = re.search(r"\{.*\}", t, flags=re.S)
-        if m:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        j = text.rfind("}")
+        if j > i:
             try:
-                return json.loads(m.group(0))
-            except Exception:
+                return orjson.loads(text[i:j + 1])
+            except orjson.JSONDecodeError:
                 return None
     return None
 
-def extract_json_from_flowise_response(resp: dict) -> dict:
-    parsed = _extract_json_anywhere(resp.get("text", ""))
-    if parsed:
-        return parsed
-
-    executed = resp.get("agentFlowExecutedData") or []
-    for node in reversed(executed):
-        node_data = node.get("data") or {}
-        out = node_data.get("output") or {}
-        if isinstance(out, dict):
-            parsed = _extract_json_anywhere(out.get("content", ""))
-            if parsed:
-                return parsed
-            for v in out.values():
-                if isinstance(v, str):
-                    parsed = _extract_json_anywhere(v)
-                    if parsed:
-                        return parsed
+def _candidates(resp: _FlowiseResp):
+    # every string that may hold the decision JSON: top-level text, then last node first, content before other fields
+    yield resp.text
+    for node in reversed(resp.agentFlowExecutedData or []):
+        out = node.data.output if node.data else None
+        if not isinstance(out, dict):
+            continue
+        c = out.get("content")
+        if isinstance(c, str):
+            yield c
+        for k, v in out.items():
+            if k != "content" and isinstance(v, str):
+                yield v
+
+def extract_json_from_flowise_response(resp: _FlowiseResp) -> dict:
+    for text in _candidates(resp):
+        parsed = _extract_json_anywhere(text)
+        if parsed:
+            return parsed
 
     raise RuntimeError("Flowise response did not contain JSON. Ensure your final node returns JSON-only in the output.")
 
-def call_flowise(question: str, extra: dict | None = None):
+_DECISION_DEFAULTS = {
+    "urgency_level": "Normal",
+    "recommended_authority": "Other",
+    "recommended_authority_details": "",
+    "assessment": "",
+    "next_steps": [],
+    "details_to_prepare": [],
+    "questions_if_missing": [],
+}
+
+def _normalize(data) -> dict:
+    # only the top-level object is required; optional fields that are missing, null or oddly typed fall back
+    if not isinstance(data, dict):
+        raise RuntimeError("Flowise JSON did not match the expected decision format: expected a JSON object")
+
+    for k, default in _DECISION_DEFAULTS.items():
+        v = data.get(k)
+        if isinstance(default, list):
+            if not isinstance(v, list):
+                data[k] = []
+        elif v is None:
+            data[k] = default
+        elif not isinstance(v, str):
+            data[k] = str(v)
+    return data
+
+async def _post_flowise(client: httpx.AsyncClient, question: str, extra_json: str, sid: str):
+    payload = {"question": question, "sessionId": sid}
+    if extra_json:
+        payload["overrideConfig"] = orjson.loads(extra_json)
+
+    body = bytearray()
+    async with client.stream("POST", _FLOWISE_URL, content=orjson.dumps(payload), headers=_FLOWISE_HEADERS) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes(65536):
+            body.extend(chunk)
+    return body
+
+async def _post_flowise_many(client: httpx.AsyncClient, calls: list[tuple]):
+    return await asyncio.gather(*(_post_flowise(client, *c) for c in calls), return_exceptions=True)
+
+def _parse_flowise(body: bytearray):
+    data = _normalize(extract_json_from_flowise_response(_DECODE_RESP.decode(body)))
+    # st.json accepts serialized JSON, so the debug view never needs the full payload as a dict
+    raw = body.decode("utf-8")
+    return data, raw
+
+def _fetch_prediction(question: str, extra_json: str):
+    # each call runs in its own throwaway Flowise session, so the reply carries no user's chat memory
+    return _parse_flowise(_run(_post_flowise, question, extra_json, secrets.token_hex(16)))
+
+class _PredictionCache:
+    # (question, extra_json) -> (data, raw), shared by all sessions; entries expire after ttl seconds
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            expires, value = hit
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._entries = {k: e for k, e in self._entries.items() if e[0] >= now}
+            self._entries[key] = (now + self._ttl, value)
+
+@st.cache_resource
+def _predictions():
+    return _PredictionCache(ttl=3600)
+
+def _flowise_args(question: str, extra: dict | None):
     if not FLOWISE_CHATFLOW_ID:
         raise RuntimeError("FLOWISE_CHATFLOW_ID is missing. Add it to .env")
 
-    url = f"{FLOWISE_BASE_URL}/api/v1/prediction/{FLOWISE_CHATFLOW_ID}"
-    payload = {"question": question, "sessionId": st.session_state.sid}
-    if extra:
-        payload["overrideConfig"] = extra
-
-    headers = {"Content-Type": "application/json"}
-    if FLOWISE_API_KEY:
-        headers["Authorization"] = f"Bearer {FLOWISE_API_KEY}"
+    extra_json = orjson.dumps(extra, option=orjson.OPT_SORT_KEYS).decode() if extra else ""
+    return question, extra_json
 
-    r = requests.post(url, json=payload, headers=headers, timeout=180)
-    r.raise_for_status()
-    raw = r.json()
-    data = extract_json_from_flowise_response(raw)
-    return data, raw
+def call_flowise(question: str, extra: dict | None = None):
+    key = _flowise_args(question, extra)
+    result = _predictions().get(key)
+    if result is None:
+        result = _fetch_prediction(*key)
+        _predictions().put(key, result)
+    return result
+
+def chat_flowise(question: str, extra: dict | None = None):
+    # chat turns build on the session's Flowise memory, so they are never cached
+    return _parse_flowise(_run(_post_flowise, *_flowise_args(question, extra), st.session_state.sid))
+
+def call_flowise_many(calls: list[tuple[str, dict | None]]):
+    # results keep input order; each is (data, raw) or the exception that call raised.
+    # Cached answers are reused; the misses are posted concurrently, one throwaway session each,
+    # and stored in the same cache call_flowise reads.
+    cache = _predictions()
+    keys = [_flowise_args(q, extra) for q, extra in calls]
+    results = [cache.get(k) for k in keys]
+    misses = [i for i, r in enumerate(results) if r is None]
+
+    bodies = _run(_post_flowise_many, [(*keys[i], secrets.token_hex(16)) for i in misses]) if misses else []
+    for i, body in zip(misses, bodies):
+        if isinstance(body, BaseException):
+            results[i] = body
+            continue
+        try:
+            results[i] = _parse_flowise(body)
+        except Exception as e:
+            results[i] = e
+            continue
+        cache.put(keys[i], results[i])
+    return results
 
 # -------------------------------
 # RENDERING
 # ------------------------------
+_PILL = {"Emergency": "danger", "High": "warn"}
+
+_DECISION_CARD = """
+<div class="card">
+  <div class="kpi">
+    <div class="pill {pill_class}">Urgency: {urgency}</div>
+    <div class="pill">Recommended authority: {authority}</div>
+  </div>
+  <hr/>
+  <div class="section-title">Assessment</div>
+  {assessment_block}
+  <hr/>
+  <div class="section-title">Who to contact</div>
+  {authority_block}
+  <hr/>
+  <div class="section-title">What to do now</div>
+</div>
+"""
+
 def render_decision(data: dict):
-    urgency = data.get("urgency_level", "Normal")
-    authority = data.get("recommended_authority", "Other")
-    authority_details = data.get("recommended_authority_details", "")
-    assessment = data.get("assessment", "")
-    next_steps = data.get("next_steps", [])
-    details_to_prepare = data.get("details_to_prepare", [])
-    questions = data.get("questions_if_missing", [])
-
-    pill_class = "ok"
-    if urgency == "Emergency":
-        pill_class = "danger"
-    elif urgency == "High":
-        pill_class = "warn"
-
-    html_block = """
-    <div class="card">
-      <div class="kpi">
-        <div class="pill {pill_class}">Urgency: {urgency}</div>
-        <div class="pill">Recommended authority: {authority}</div>
-      </div>
-      <hr/>
-      <div class="section-title">Assessment</div>
-      {assessment_block}
-      <hr/>
-      <div class="section-title">Who to contact</div>
-      {authority_block}
-      <hr/>
-      <div class="section-title">What to do now</div>
-    </div>
-    """
+    urgency = data["urgency_level"]
+    authority = data["recommended_authority"]
+    authority_details = data["recommended_authority_details"]
+    assessment = data["assessment"]
+    next_steps = data["next_steps"]
+    details_to_prepare = data["details_to_prepare"]
+    questions = data["questions_if_missing"]
+
+    pill_class = _PILL.get(urgency, "ok")
 
     assessment_block = assessment if assessment else "<span class='small'>(No assessment)</span>"
     authority_block = authority_details if authority_details else "<span class='small'>(Not enough info)</span>"
 
-    html_block = html_block.format(
+    html_block = _DECISION_CARD.format(
         pill_class=pill_class,
         urgency=urgency,
         authority=authority,
@@ -251,18 +406,18 @@ def render_decision(data: dict):
         authority_block=authority_block
     )
 
-    st.markdown(html_block, unsafe_allow_html=True)
+    _html(html_block)
 
-    if isinstance(next_steps, list) and next_steps:
-        st.markdown("\n".join([f"- {s}" for s in next_steps]))
+    if next_steps:
+        st.markdown("\n".join(f"- {s}" for s in next_steps))
 
     st.markdown("**What details to prepare**")
-    if isinstance(details_to_prepare, list) and details_to_prepare:
-        st.markdown("\n".join([f"- {s}" for s in details_to_prepare]))
+    if details_to_prepare:
+        st.markdown("\n".join(f"- {s}" for s in details_to_prepare))
 
-    if isinstance(questions, list) and questions:
+    if questions:
         st.markdown("**Quick questions (if needed)**")
-        st.markdown("\n".join([f"- {q}" for q in questions]))
+        st.markdown("\n".join(f"- {q}" for q in questions))
 
 
 
@@ -390,9 +545,9 @@ f"Category: {issue_category}"
             st.markdown("### ✅ Recommendation")
             render_decision(data)
 
-            if show_debug:
+            if show_debug and raw:
                 with st.expander("🧪 Raw Flowise response (debug)"):
-                    st.code(json.dumps(raw, indent=2, ensure_ascii=False))
+                    st.json(raw, expanded=False)
 
 # -------------------------------
 # TAB: ASK QUESTION (Chat UI only)
@@ -413,38 +568,37 @@ with tab_chat:
 
         with st.spinner("Sending to Flowise…"):
             try:
-                data, raw = call_flowise(question=user_msg)
+                data, raw = chat_flowise(question=user_msg)
             except Exception as e:
                 st.session_state.chat_messages.append({"role": "assistant", "content": f"Flowise call failed: {e}"})
                 with st.chat_message("assistant"):
                     st.error(f"Flowise call failed: {e}")
                 st.stop()
 
-        pretty = f"""**Urgency:** {data.get('urgency_level','Normal')}
-
-**Recommended authority:** {data.get('recommended_authority','Other')}
-
-**Assessment:** {data.get('assessment','')}
-
-**Next steps:**
-"""
-        steps = data.get("next_steps", [])
-        if isinstance(steps, list) and steps:
-            pretty += "\n".join([f"- {s}" for s in steps])
+        parts = [
+            f"**Urgency:** {data['urgency_level']}\n\n",
+            f"**Recommended authority:** {data['recommended_authority']}\n\n",
+            f"**Assessment:** {data['assessment']}\n\n",
+            "**Next steps:**\n",
+        ]
+        steps = data["next_steps"]
+        if steps:
+            parts.append("\n".join(f"- {s}" for s in steps))
         else:
-            pretty += "- (No steps returned)"
+            parts.append("- (No steps returned)")
 
-        details = data.get("recommended_authority_details", "")
+        details = data["recommended_authority_details"]
         if details:
-            pretty += f"\n\n**Who to contact:** {details}"
+            parts.append(f"\n\n**Who to contact:** {details}")
+        pretty = "".join(parts)
 
         st.session_state.chat_messages.append({"role": "assistant", "content": pretty})
         with st.chat_message("assistant"):
             st.markdown(pretty)
 
-        if show_debug:
+        if show_debug and raw:
             with st.expander("🧪 Raw Flowise response (debug)"):
-                st.code(json.dumps(raw, indent=2, ensure_ascii=False))
+                st.json(raw, expanded=False)
 
 # -------------------------------
 # TAB: EVALUATION MODE (UI only)
@@ -479,6 +633,7 @@ with tab_eval:
         st.text_input("Scenario location", value=s["location"], disabled=True)
     with colB:
         run = st.button("▶ Run evaluation", use_container_width=True)
+        run_all = st.button("▶ Run ALL scenarios", use_container_width=True)
 
     if run:
         question = "\n".join([
@@ -496,15 +651,38 @@ with tab_eval:
         st.markdown("### ✅ Recommendation")
         render_decision(data)
 
-        if show_debug:
+        if show_debug and raw:
             with st.expander("🧪 Raw Flowise response (debug)"):
-                st.code(json.dumps(raw, indent=2, ensure_ascii=False))
+                st.json(raw, expanded=False)
+
+    if run_all:
+        with st.spinner("Sending all scenarios to Flowise…"):
+            try:
+                results = call_flowise_many([
+                    (f"{v['issue']}\nLocation: {v['location']}", {"location": v["location"]})
+                    for v in scenarios.values()
+                ])
+            except Exception as e:
+                st.error(f"Flowise call failed: {e}")
+                st.stop()
+
+        for name, result in zip(scenarios, results):
+            st.markdown(f"### ✅ {name}")
+            if isinstance(result, Exception):
+                st.error(f"Flowise call failed: {result}")
+                continue
+            data, raw = result
+            render_decision(data)
+
+            if show_debug and raw:
+                with st.expander(f"🧪 Raw Flowise response (debug) — {name}"):
+                    st.json(raw, expanded=False)
 
 # -------------------------------
 # TAB: ABOUT
 # -------------------------------
 with tab_about:
-    st.markdown(
+    _html(
         """
 <div class="card">
 <b>What this UI does</b><br/>
@@ -522,6 +700,5 @@ and provides a downloadable report summary.<br/><br/>
 <b>Run</b><br/>
 <code>streamlit run app1_ui_updated.py</code>
 </div>
-""",
-        unsafe_allow_html=True,
+"""
     )